@@ -17,22 +17,30 @@
     To use as is, you need to set your electricobjects.com login credentials. See the
     get_credentials() function for how to do so.
 
-    Randomized images are picked among the first 200 images shown on your favorites page on
-    electricobjects.com. Change MAX_FAVORITES_FOR_DISPLAY below to adjust this limit.
+    Randomized images are picked among all of the images shown on your favorites page on
+    electricobjects.com. No image is repeated within ROTATION_WINDOW updates. Without a rotation,
+    display_random_favorite() picks among the first MAX_FAVORITES_FOR_DISPLAY images.
 
     Usage: $ python eo.py
+           $ python eo.py --once
+           $ python eo.py --watch
+           $ python eo.py --export favorites.jsonl.gz
 
     Written for Python 2.7.x.
 """
 
 import eo_api
+from exporter import Exporter
 import logging
 import logging.handlers
+from multiprocessing.pool import ThreadPool
 import os
 import random
 import requests
+from rotation import Rotation
 from scheduler import Scheduler
 import sys
+from watcher import DeviceWatcher
 
 CREDENTIALS_FILE = ".credentials"
 USER_ENV_VAR = "EO_USER"
@@ -51,12 +59,25 @@ MAX_FAVORITES_FOR_DISPLAY = 200
 # The number of favorites to pull per request.
 NUM_FAVORITES_PER_REQUEST = 30
 
+# Favorites are rotated so that none is repeated within ROTATION_WINDOW updates. The rotation is
+# saved in ROTATION_FILE between runs.
+ROTATION_FILE = ".rotation"
+ROTATION_WINDOW = 50
+
+# Pass as the device_id to set_url() to set the URL on all of the user's devices.
+ALL_DEVICES = "all"
+
+# The most set_url requests to have in flight at once. Requests are rate limited regardless.
+SET_URL_CONCURRENCY = 4
+
 
 class ElectricObject(object):
     """The ElectricObject class provides functions for the Electric Objects EO1."""
 
     def __init__(self, username, password):
         self.api = eo_api.EO_API(username, password)
+        self.cached_device_ids = None
+        self.device_ids_session = None  # The session in which cached_device_ids were requested.
         self.logger = logging.getLogger(".".join(["eo", self.__class__.__name__]))
 
     def user(self):
@@ -79,11 +100,34 @@ class ElectricObject(object):
         """Return the user's list of favorites in JSON else [].
 
         Returns:
-            An array of up to NUM_FAVORITES_PER_REQUEST favorites in JSON format
+            An array of up to MAX_FAVORITES_FOR_DISPLAY favorites in JSON format
             or else an empty list.
         """
-        offset = 0
         favorites = []
+        for offset, page in self.favorites_pages():
+            if page is None:
+                break
+            favorites.extend(page)
+            if len(favorites) > MAX_FAVORITES_FOR_DISPLAY:  # too many
+                favorites = favorites[:MAX_FAVORITES_FOR_DISPLAY]
+                break
+        return favorites
+
+    def favorites_pages(self, offset=0):
+        """Generate the user's favorites one page at a time, starting at the given offset.
+
+        Unlike favorites(), there is no cap on the number of favorites returned and only one page
+        is held in memory at a time. Generation stops after the last page, which is the first one
+        with fewer than NUM_FAVORITES_PER_REQUEST favorites, or after an error.
+
+        Args:
+            offset: the index of the first favorite to request.
+
+        Yields:
+            (offset, page) tuples, where page is a list of up to NUM_FAVORITES_PER_REQUEST
+            favorites in JSON format and offset is the index of its first favorite. If a request
+            fails, page is None, so callers can tell an error from the end of the favorites.
+        """
         while True:
             params = {
               "limit": NUM_FAVORITES_PER_REQUEST,
@@ -91,21 +135,40 @@ class ElectricObject(object):
             }
             result_JSON = self.api.make_request("favorited", method="GET", params=params,
                                                 parse_json=True)
-            if not result_JSON:
-                break
-            favorites.extend(result_JSON)
-            if len(result_JSON) < NUM_FAVORITES_PER_REQUEST:  # last page
-                break
-            if len(favorites) > MAX_FAVORITES_FOR_DISPLAY:  # too many
-                favorites = favorites[:MAX_FAVORITES_FOR_DISPLAY]
+            if result_JSON is None:
+                self.logger.error("unable to read favorites at offset {0}.".format(offset))
+            yield offset, result_JSON
+            if result_JSON is None or len(result_JSON) < NUM_FAVORITES_PER_REQUEST:  # last page
                 break
             offset += NUM_FAVORITES_PER_REQUEST
-        return favorites
+
+    def favorite_ids(self):
+        """Return the artwork ids of all of the user's favorites, else None.
+
+        Unlike favorites(), there is no cap, and only one page of favorites JSON is held at a
+        time. A failed request returns None rather than a partial list, so that callers such as
+        a Rotation don't mistake the missing favorites for removed ones.
+        """
+        ids = []
+        for offset, page in self.favorites_pages():
+            if page is None:
+                return None
+            ids.extend(fav["artwork"]["id"] for fav in page)
+        return ids
 
     def devices(self):
         """Return a list of devices in JSON format, else None."""
         return self.api.make_request("devices", method="GET", parse_json=True)
 
+    def devices_if_modified(self, etag=None):
+        """Return the list of devices unless it's unchanged since the response with the given ETag.
+
+        Returns:
+            A (modified, devices, etag) tuple, where devices is None if not modified, or None on
+            error.
+        """
+        return self.api.make_conditional_request("devices", etag=etag)
+
     def choose_random_item(self, items, excluded_id=None):
         """Return a random item, avoiding the one with the excluded_id, if given.
         Args:
@@ -141,7 +204,7 @@ class ElectricObject(object):
             self.logger.error("problem parsing device JSON. Missing key: {0}".format(e))
         return id
 
-    def display_random_favorite(self):
+    def display_random_favorite(self, rotation=None):
         """Retrieve the user's favorites and display one of them randomly on the first device
         associated with the signed-in user.
 
@@ -154,6 +217,12 @@ class ElectricObject(object):
             This function works on the first device if there are multiple devices associated
             with the given user.
 
+        Args:
+            rotation: an optional Rotation to pick the favorite, so that favorites aren't
+                repeated within its window. The rotation picks among all of the user's
+                favorites, with no MAX_FAVORITES_FOR_DISPLAY cap. If it has a path, it's saved
+                after the favorite is displayed.
+
         Returns:
             The id of the displayed favorite, else 0.
         """
@@ -164,34 +233,136 @@ class ElectricObject(object):
         device_index = 0  # First device of user.
         current_image_id = self.current_artwork_id(devs[device_index])
 
-        favs = self.favorites()
-        if favs == []:
-            return 0
-        fav_item = self.choose_random_item(favs, current_image_id)
-        if not fav_item:
-            return 0
-        fav_id = fav_item["artwork"]["id"]
+        if rotation:
+            fav_ids = self.favorite_ids()
+            if not fav_ids:
+                return 0
+            fav_id = rotation.next(fav_ids, current_image_id)
+            if not fav_id:
+                return 0
+        else:
+            favs = self.favorites()
+            if favs == []:
+                return 0
+            fav_item = self.choose_random_item(favs, current_image_id)
+            if not fav_item:
+                return 0
+            fav_id = fav_item["artwork"]["id"]
         res = self.display(str(fav_id))
+        if res and rotation and rotation.path:
+            rotation.save()
         return fav_id if res else 0
 
-    def set_url(self, url):
-        """Display the given URL on the first device associated with the signed-in user.
-        Return True on success.
+    def device_ids(self, refresh=False):
+        """Return the ids of the user's devices, else [].
+
+        The ids are cached after the first successful request, until the next sign-in creates a
+        new session. Pass refresh=True to request them again, for example after adding a device.
         """
-        devs = self.devices()
-        if not devs:
-            self.logger.error("in set_url: no devices returned.")
-            return 0
-        device_index = 0  # First device of user.
-        device_id = devs[device_index]["id"]
+        session = self.api.net.get_session()
+        if self.cached_device_ids is None or refresh or session is not self.device_ids_session:
+            devs = self.devices()
+            if not devs:
+                self.logger.error("in device_ids: no devices returned.")
+                return []
+            self.cached_device_ids = [dev["id"] for dev in devs]
+            self.device_ids_session = self.api.net.get_session()
+        return self.cached_device_ids
+
+    def set_url(self, url, device_id=None):
+        """Display the given URL on one or more devices associated with the signed-in user.
+
+        When the devices come from the cached device ids, a client error (4xx) for any of them
+        suggests a device was removed or re-registered. The ids are then refreshed once, and the
+        URL is pushed to the target devices that haven't been set yet.
+
+        Args:
+            url: the URL to display.
+            device_id: a device id, a list of device ids, or ALL_DEVICES. If None, the first
+                device is used.
+
+        Returns:
+            True if the URL was set on every device.
+        """
+        if isinstance(device_id, (list, tuple)):
+            device_ids = device_id
+        elif device_id is not None and device_id != ALL_DEVICES:
+            device_ids = [device_id]
+        else:
+            device_ids = self.target_device_ids(device_id)
+        if not device_ids:
+            self.logger.error("in set_url: no devices to set.")
+            return False
+
+        statuses = self.push_urls([(d, url) for d in device_ids])
+        if all(status == requests.codes.ok for status in statuses):
+            return True
+        cached = device_id is None or device_id == ALL_DEVICES
+        if not cached or not any(status and 400 <= status < 500 for status in statuses):
+            return False
+
+        self.device_ids(refresh=True)
+        done = set(d for (d, status) in zip(device_ids, statuses) if status == requests.codes.ok)
+        device_ids = [d for d in self.target_device_ids(device_id) if d not in done]
+        return all(status == requests.codes.ok
+                   for status in self.push_urls([(d, url) for d in device_ids]))
+
+    def target_device_ids(self, device_id):
+        """Return the cached ids of the first device if device_id is None, or of all devices if
+        it's ALL_DEVICES.
+        """
+        if device_id == ALL_DEVICES:
+            return self.device_ids()
+        return self.device_ids()[:1]  # First device of user.
+
+    def set_urls(self, device_urls):
+        """Display URLs on devices, making up to SET_URL_CONCURRENCY requests at a time.
+
+        Requests are still rate limited, but overlapping them hides most of the time spent
+        waiting on the server. The authenticity token needed to set URLs is requested once and
+        reused for every device.
+
+        Args:
+            device_urls: a list of (device id, URL) pairs.
+
+        Returns:
+            A list with True for each pair whose URL was set, else False, in the same order.
+        """
+        return [status == requests.codes.ok for status in self.push_urls(device_urls)]
+
+    def push_urls(self, device_urls):
+        """Set URLs on devices as described in set_urls().
 
+        Returns:
+            A list with the HTTP status code of the response for each pair, or None if there was
+            no response, in the same order.
+        """
+        if not device_urls:
+            return []
+        failed = [None] * len(device_urls)
+        if not self.api.check_signin_status():
+            return failed
+
+        # Get the token before the requests fan out, so they don't each request it.
         request_url = self.api.base_url + "set_url"
-        params = {
-          "device_id": device_id,
-          "custom_url": url
-        }
-        response = self.api.net.post_with_authenticity(request_url, params)
-        return response.status_code == requests.codes.ok
+        if not self.api.net.authenticity_token(request_url):
+            self.logger.error("in set_urls: no authenticity token.")
+            return failed
+
+        def set_one(device_url):
+            params = {
+              "device_id": device_url[0],
+              "custom_url": device_url[1]
+            }
+            response = self.api.net.send_with_authenticity(request_url, params)
+            self.api.net.check_post_response(request_url, response)  # Logs failures.
+            return response.status_code if response is not None else None
+
+        pool = ThreadPool(min(SET_URL_CONCURRENCY, len(device_urls)))
+        try:
+            return pool.map(set_one, device_urls)
+        finally:
+            pool.close()
 
 
 def get_credentials():
@@ -252,11 +423,19 @@ def show_a_new_favorite(eo):
     """Update the EO1 with a new, randomly selected favorite."""
     logger = logging.getLogger("eo")
     logger.info('Updating favorite')
-    displayed = eo.display_random_favorite()
+    rotation = Rotation.load(ROTATION_FILE, ROTATION_WINDOW)
+    displayed = eo.display_random_favorite(rotation)
     if displayed:
         logger.info("Displayed artwork id " + str(displayed))
 
 
+def log_device_change(change):
+    """Log a change found by the DeviceWatcher."""
+    logger = logging.getLogger("eo")
+    logger.info("Device {0} {1}: artwork id {2} -> {3}".format(
+        change.device_id, change.kind, change.old_artwork_id, change.new_artwork_id))
+
+
 def demo(eo):
     """An example that displays a random favorite."""
     logger = logging.getLogger("eo")
@@ -304,6 +483,20 @@ def main():
         show_a_new_favorite(eo)
         exit()
 
+    if len(sys.argv) > 1 and sys.argv[1] == "--watch":
+        watcher = DeviceWatcher([eo])
+        watcher.add_callback(log_device_change)
+        watcher.run()
+        exit()
+
+    if len(sys.argv) > 1 and sys.argv[1] == "--export":
+        if len(sys.argv) < 3:
+            logger = logging.getLogger("eo")
+            logger.error("--export needs the path of the file to export to. Exiting.")
+            exit(1)
+        exported = Exporter(eo, sys.argv[2]).export()
+        exit(0 if exported is not None else 1)
+
     scheduler = Scheduler(SCHEDULE, lambda: show_a_new_favorite(eo), schedule_jitter=SCHEDULE_JITTER)
     scheduler.run()
 
@@ -104,3 +104,27 @@ class EO_API(object):
             url += path_append
 
         return self.net.make_request(url, params=params, method=method, parse_json=parse_json)
+
+    def make_conditional_request(self, endpoint, etag=None, params=None):
+        """Make a GET request to the Electric Objects API that is skipped by the server if the
+        result hasn't changed since the response with the given ETag.
+
+        Args:
+            endpoint: The id of the request target API path in self.endpoints.
+            etag: The ETag of a previous response from this endpoint, or None.
+            params: The URL parameters.
+
+        Returns:
+            A (modified, result_JSON, etag) tuple as described in
+            EO_Net.make_conditional_request(), or None on error.
+        """
+        signin_ok = self.check_signin_status()
+        if not signin_ok:
+            return None
+
+        if endpoint not in self.endpoints.keys():
+            self.logger.error("unknown endpoint requested: " + endpoint)
+            return None
+
+        url = self.base_url + self.api_version_path + self.endpoints[endpoint]
+        return self.net.make_conditional_request(url, etag=etag, params=params)
@@ -2,6 +2,7 @@ from lxml import html
 import logging
 import random
 import requests
+import threading
 import time
 
 # BEST PRACTICE, "rate limiting": don't hit server at maximum rate.
@@ -25,11 +26,48 @@ NUM_RETRIES = 4
 # The amount of variation as a float. 0.20 == +/- 20%
 JITTER_FACTOR = 0.20
 
+# Responses to a post that suggest its authenticity token was rejected, such as by expiring.
+# Posts that fail with these are retried once with a fresh token.
+BAD_TOKEN_STATUS_CODES = (401, 403, 422)
+
 # Note if a logger is not configured when this class is instantiated, an error will issue like:
 #       No handlers could be found for logger "eo.EO_Net"
 # To fix, initialize a logger in your main. This class writes error messages to the logging system.
 
 
+class RequestBudget(object):
+    """A rate limit shared by any number of EO_Net objects, such as those of many accounts.
+
+    Each HTTP request made by an EO_Net whose request_budget is set takes one slot, including
+    retries and the requests made while signing in. Slots are spaced evenly, so no more than
+    max_requests requests start in any period.
+    """
+
+    def __init__(self, max_requests, period, timefunc=time.time, delayfunc=time.sleep):
+        """Initialize the budget.
+
+        Args:
+            max_requests: the most requests to start in each period.
+            period: the length of the period in seconds.
+            timefunc: a function returning the current time in seconds.
+            delayfunc: a function that waits the given number of seconds.
+        """
+        self.interval = float(period) / max_requests
+        self.timefunc = timefunc
+        self.delayfunc = delayfunc
+        self.next_slot = None
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Wait for the next free slot. This function is thread-safe."""
+        with self.lock:
+            now = self.timefunc()
+            slot = now if self.next_slot is None else max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            self.delayfunc(slot - now)
+
+
 class EO_Net(object):
     """The EO_Net class provides network functions for the API.
 
@@ -42,19 +80,30 @@ class EO_Net(object):
         self.logger = logging.getLogger(".".join(["eo", self.__class__.__name__]))
         self.session = None
         self.last_request_time = 0
+        self.request_rate_lock = threading.Lock()
+        self.request_budget = None  # An optional RequestBudget shared with other EO_Nets.
+
+        # Authenticity tokens by URL, for reuse within the current session.
+        self.authenticity_tokens = {}
+        self.authenticity_lock = threading.Lock()
+
+        # The retry policy. See request_with_retries().
+        self.initial_retry_delay = INITIAL_RETRY_DELAY
+        self.num_retries = NUM_RETRIES
+        self.jitter_factor = JITTER_FACTOR
 
     def get_session(self):
         return self.session
 
     def set_session(self, session):
         self.session = session
+        self.authenticity_tokens = {}  # Tokens belong to the session they were issued in.
 
     def request_authenticity_token(self, url):
         """Request, parse, and return the authenticity token needed to post to the given URL."""
         authenticity_token = ""
 
         # Request the page with the token.
-        self.check_request_rate()
         response = self.request_with_retries(url)
         if not response:
             self.logger.error("unable to read {0}.".format(url))
@@ -72,17 +121,51 @@ class EO_Net(object):
             self.logger.error("problem parsing authenticity token: " + str(e))
         return authenticity_token
 
+    def authenticity_token(self, url, stale_token=None):
+        """Return the authenticity token needed to post to the given URL. Return "" on error.
+
+        The token is requested only if none is cached for the current session, or if the cached
+        token is stale_token, one the server rejected. This function is thread-safe. Threads
+        that need the same token share one request for it.
+        """
+        with self.authenticity_lock:
+            authenticity_token = self.authenticity_tokens.get(url)
+            if not authenticity_token or authenticity_token == stale_token:
+                authenticity_token = self.request_authenticity_token(url)
+                if authenticity_token:
+                    self.authenticity_tokens[url] = authenticity_token
+        return authenticity_token
+
     def post_with_authenticity(self, url, payload):
         """Post to the given URL, first obtaining an authenticity token and adding it to the
         payload.
 
+        The token is cached, so repeated posts to the same URL take one request each. If the
+        server rejects a cached token with one of BAD_TOKEN_STATUS_CODES, the token may have
+        expired, so the post is retried once with a fresh token. Other failures, such as an
+        unavailable server, aren't retried beyond request_with_retries().
+
         Return the request result or None.
         """
-        authenticity_token = self.request_authenticity_token(url)
+        return self.check_post_response(url, self.send_with_authenticity(url, payload))
+
+    def send_with_authenticity(self, url, payload):
+        """Post to the given URL as post_with_authenticity() does, but return the server's
+        response whatever its status, or None if there was no response or no token.
+        """
+        cached = url in self.authenticity_tokens
+        authenticity_token = self.authenticity_token(url)
         if not authenticity_token:
             return None
         payload["authenticity_token"] = authenticity_token
-        return self.post_payload(url, payload)
+        response = self.request_with_retries(url, method="POST", params=payload)
+        if cached and response is not None and response.status_code in BAD_TOKEN_STATUS_CODES:
+            authenticity_token = self.authenticity_token(url, stale_token=authenticity_token)
+            if not authenticity_token:
+                return None
+            payload["authenticity_token"] = authenticity_token
+            response = self.request_with_retries(url, method="POST", params=payload)
+        return response
 
     def post_payload(self, url, payload):
         """Post the given payload to the given URL
@@ -94,12 +177,17 @@ class EO_Net(object):
         Returns:
             The server's response or None.
         """
-        self.check_request_rate()
         response = self.request_with_retries(url, method="POST", params=payload)
-        if response and response.status_code == requests.codes.ok:
+        return self.check_post_response(url, response)
+
+    def check_post_response(self, url, response):
+        """Return the response to a post to the given URL if it succeeded. Otherwise, log the
+        failure and return None.
+        """
+        if response is not None and response.status_code == requests.codes.ok:
             return response
 
-        if not response:
+        if response is None:
             self.logger.error("unable to post to {0}.".format(url))
         else:
             self.logger.error("unable to post to {0}. Status: {1}, response: {2}".
@@ -112,28 +200,35 @@ class EO_Net(object):
         Specifically, check the current time against the last request time. If
         less than MIN_REQUEST_INTERVAL, sleep the remaining time.
 
-        TODO: This function pauses the whole program. Improvement: create a
-        request queue that handles request asynchronously.
+        This function is thread-safe. Each caller reserves the next free time slot, so
+        concurrent requests are spaced MIN_REQUEST_INTERVAL apart and only the calling
+        thread pauses.
         """
-        interval = time.clock() - self.last_request_time
-        if interval < MIN_REQUEST_INTERVAL:
-            time.sleep(MIN_REQUEST_INTERVAL - interval)
-
-    def execute_request(self, url, params=None, method="GET"):
+        with self.request_rate_lock:
+            now = time.time()
+            wait = self.last_request_time + MIN_REQUEST_INTERVAL - now
+            self.last_request_time = now + max(wait, 0)
+        if wait > 0:
+            time.sleep(wait)
+
+    def execute_request(self, url, params=None, method="GET", headers=None):
         """Request the given URL with the given method and parameters.
 
         Args:
             url: The URL to call.
             params: The optional parameters.
             method: The HTTP request type {GET, POST, PUT, DELETE}.
+            headers: Optional extra HTTP headers for GET requests.
 
         Returns:
             The server response or None.
         """
         self.check_request_rate()
+        if self.request_budget:
+            self.request_budget.acquire()
         try:
             if method == "GET":
-                return self.session.get(url, params=params)
+                return self.session.get(url, params=params, headers=headers)
             elif method == "POST":
                 return self.session.post(url, params=params)
             elif method == "PUT":
@@ -146,10 +241,10 @@ class EO_Net(object):
             self.logger.error("problem making HTTP request: {0}".format(e))
         return None
 
-    def request_with_retries(self, url, params=None, method="GET"):
+    def request_with_retries(self, url, params=None, method="GET", headers=None):
         """Call the given request, returning the response or None if error.
 
-        Retry the request up to NUM_RETRIES times if:
+        Retry the request up to self.num_retries times, NUM_RETRIES by default, if:
 
         1) execute_request() returns None, which would indicate a problem caught the request
         library. These would include network connectivity issues or request timeouts.
@@ -163,34 +258,53 @@ class EO_Net(object):
             url: The URL to call.
             params: The optional parameters.
             method: The HTTP request type {GET, POST, PUT, DELETE}.
+            headers: Optional extra HTTP headers for GET requests.
 
         Returns:
             The server response or None.
         """
         retries = 0
-        delay = INITIAL_RETRY_DELAY
+        delays = self.retry_delays()
         while True:
-            pass
-            response = self.execute_request(url, params=params, method=method)
-
-            if response:
-                if response.status_code < 500:
-                    return response
-                else:
-                    self.logger.error("from API server. Response: {0} {1}.".
-                                      format(response.status_code, response.reason))
-
-            if retries == NUM_RETRIES:
+            response = self.execute_request(url, params=params, method=method, headers=headers)
+            if not self.should_retry(response):
+                return response
+            if response is not None:
+                self.logger.error("from API server. Response: {0} {1}.".
+                                  format(response.status_code, response.reason))
+
+            jittered_delay = next(delays, None)
+            if jittered_delay is None:
                 break
 
-            # Jitter: avoid hitting servers at fixed times or with fixed delays. Instead,
-            # prevent client synchronization and server overloads by varying access times.
-            jittered_delay = self.jitter(delay, JITTER_FACTOR)
-
             # retries + 1: Use natural numbers for readability.
             self.logger.error(
                 "failed request {0} of {1} to URL '{2}'. Retrying in {3:.1f} seconds.".format(
-                    retries + 1, NUM_RETRIES + 1, url, jittered_delay))
+                    retries + 1, self.num_retries + 1, url, jittered_delay))
+            retries += 1
+            time.sleep(jittered_delay)
+
+        self.logger.error("maximum HTTP request attempts ({0}) exceeded to URL '{1}'.".format(
+            self.num_retries + 1, url))
+        return None
+
+    def should_retry(self, response):
+        """Return True if the given result of execute_request() is a failure worth retrying. See
+        request_with_retries().
+        """
+        return response is None or response.status_code >= 500
+
+    def retry_delays(self):
+        """Generate the delay before each retry, up to self.num_retries delays.
+
+        The delays start at self.initial_retry_delay and double with each retry. Each is
+        jittered by self.jitter_factor.
+        """
+        delay = self.initial_retry_delay
+        for _ in range(self.num_retries):
+            # Jitter: avoid hitting servers at fixed times or with fixed delays. Instead,
+            # prevent client synchronization and server overloads by varying access times.
+            yield self.jitter(delay, self.jitter_factor)
 
             # Exponential backoff: Double the delay between each retry, or equivilently,
             #     delay = INITIAL_RETRY_DELAY * 2 ** retries
@@ -198,12 +312,6 @@ class EO_Net(object):
             # delay increases significantly with each retry, allowing congestion at the server
             # to disperse.
             delay *= 2
-            retries += 1
-            time.sleep(jittered_delay)
-
-        self.logger.error("maximum HTTP request attempts ({0}) exceeded to URL '{1}'.".format(
-            NUM_RETRIES + 1, url))
-        return None
 
     def make_request(self, url, params=None, method="GET", parse_json=False):
         """Create and make the given request, returning the result as JSON if requested.
@@ -225,6 +333,40 @@ class EO_Net(object):
             self.logger.error("unable to parse JSON")
         return None
 
+    def make_conditional_request(self, url, etag=None, params=None):
+        """GET the given URL as JSON, unless it hasn't changed since the response with the given
+        ETag.
+
+        Servers that support conditional requests reply 304 Not Modified with no body if the
+        resource still matches the ETag. Servers that don't simply return the full response.
+
+        Args:
+            url: The URL to call.
+            etag: The ETag header of a previous response from this URL, or None.
+            params: The optional parameters.
+
+        Returns:
+            A (modified, result_JSON, etag) tuple, or None on error. If the server replies 304 Not
+            Modified, modified is False and result_JSON is None. The returned etag is the one to
+            send with the next request.
+        """
+        headers = {"If-None-Match": etag} if etag else None
+        response = self.request_with_retries(url, params=params, method="GET", headers=headers)
+        if response is None:
+            return None
+        elif response.status_code == requests.codes.not_modified:
+            return (False, None, etag)
+        elif response.status_code < 200 or response.status_code >= 300:
+            self.logger.error("sent GET to url {0} with parameters {1}. Response: {2} {3}".
+                              format(url, params, response.status_code, response.reason))
+            return None
+
+        try:
+            return (True, response.json(), response.headers.get("ETag"))
+        except:
+            self.logger.error("unable to parse JSON")
+        return None
+
     def jitter(self, interval, factor):
         """Return the interval +/- a randomized amount of the interval.
 
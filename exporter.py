@@ -0,0 +1,157 @@
+import csv
+import gzip
+import json
+import logging
+import os
+
+# Output formats, chosen by the export file's extension. A trailing ".gz" adds gzip compression,
+# e.g. "favorites.jsonl.gz".
+FORMAT_JSONL = "jsonl"
+FORMAT_CSV = "csv"
+GZIP_EXTENSION = ".gz"
+
+# The checkpoint is stored next to the export file, e.g. "favorites.jsonl.checkpoint".
+CHECKPOINT_EXTENSION = ".checkpoint"
+
+CSV_COLUMNS = ["kind", "id", "artwork_id", "json"]
+
+
+class Exporter(object):
+    """The Exporter streams a user's devices and full favorites library to a JSON-lines or CSV file.
+
+    Favorites are requested one page at a time and written as soon as they arrive, so memory use
+    is bounded by the page size rather than the size of the library. After each page is written,
+    the offset of the next page and the size of the file are saved to a checkpoint file. If the
+    export is interrupted, running it again with the same path truncates the file to the
+    checkpointed size, dropping any partly written page, and appends from the checkpointed offset.
+    The checkpoint is removed when the export completes.
+
+    Gzip output is written as one gzip member per page, so the checkpointed size always falls on a
+    member boundary. Gzip readers treat the members as one continuous stream.
+
+    Each record is one device or one favorite. In JSON-lines output, each line is an object of the
+    form {"kind": "device" or "favorite", "data": <the JSON returned by the API>}. In CSV output,
+    the JSON is stored in the "json" column alongside the record's id and artwork id.
+    """
+
+    def __init__(self, eo, path):
+        """Initialize the exporter.
+
+        Args:
+            eo: the ElectricObject whose devices and favorites will be exported.
+            path: the export file. Its extension sets the format: ".jsonl" or ".csv", optionally
+                followed by ".gz".
+        """
+        self.logger = logging.getLogger(".".join(["eo", self.__class__.__name__]))
+        self.eo = eo
+        self.path = path
+        self.checkpoint_path = path + CHECKPOINT_EXTENSION
+
+        base = path
+        self.compress = base.endswith(GZIP_EXTENSION)
+        if self.compress:
+            base = base[:-len(GZIP_EXTENSION)]
+        self.format = FORMAT_CSV if base.endswith("." + FORMAT_CSV) else FORMAT_JSONL
+
+    def read_checkpoint(self):
+        """Return the saved checkpoint as a dict, or None if there is no usable checkpoint."""
+        try:
+            with open(self.checkpoint_path, "r") as f:
+                checkpoint = json.load(f)
+            int(checkpoint["offset"])
+            int(checkpoint["size"])
+            return checkpoint
+        except (IOError, OSError):
+            return None
+        except Exception as e:
+            self.logger.error("ignoring unreadable checkpoint {0}: {1}".format(
+                self.checkpoint_path, e))
+            return None
+
+    def write_checkpoint(self, offset, size):
+        """Save the offset of the next page of favorites to export and the size of the export
+        file once the pages before it are written.
+
+        The checkpoint is written to a temporary file and renamed so that an interruption can't
+        leave a partially written checkpoint behind.
+        """
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"offset": offset, "size": size}, f)
+        os.rename(tmp_path, self.checkpoint_path)
+
+    def open_output(self, size):
+        """Open the export file for writing. If size is given, resume an export by truncating the
+        file to that size and appending to it. Otherwise start a new, empty file.
+        """
+        if size is None:
+            return open(self.path, "wb")
+        f = open(self.path, "r+b")
+        f.truncate(size)
+        f.seek(size)
+        return f
+
+    def write_records(self, f, records, header=False):
+        """Write a list of (kind, data, artwork id) records to the export file, make sure they're
+        on disk, and return the file's new size. If header is True, CSV output starts with the
+        column names.
+
+        Records written together form one gzip member when compressing, so that the returned size
+        is always a point where the file can be truncated and appended to.
+        """
+        out = gzip.GzipFile(fileobj=f, mode="wb") if self.compress else f
+        writer = csv.writer(out) if self.format == FORMAT_CSV else None
+        if writer and header:
+            writer.writerow(CSV_COLUMNS)
+        for (kind, data, artwork_id) in records:
+            if writer:
+                writer.writerow([kind, data.get("id", ""), artwork_id, json.dumps(data)])
+            else:
+                out.write(json.dumps({"kind": kind, "data": data}) + "\n")
+        if self.compress:
+            out.close()  # Ends the gzip member. The underlying file stays open.
+        f.flush()
+        os.fsync(f.fileno())
+        return f.tell()
+
+    def export(self):
+        """Export the devices and favorites, resuming from the checkpoint if there is one.
+
+        Returns:
+            The number of favorites written during this run, or None on error. After an error,
+            running the export again resumes it.
+        """
+        checkpoint = self.read_checkpoint()
+        resuming = (checkpoint is not None and os.path.exists(self.path) and
+                    os.path.getsize(self.path) >= checkpoint["size"])
+        offset = checkpoint["offset"] if resuming else 0
+
+        if resuming:
+            self.logger.info("resuming export to {0} at offset {1}".format(self.path, offset))
+        else:
+            # The device state is small, so it's written in full at the start of each new export.
+            devs = self.eo.devices()
+            if devs is None:
+                self.logger.error("in export: no devices returned.")
+                return None
+
+        count = 0
+        with self.open_output(checkpoint["size"] if resuming else None) as f:
+            if not resuming:
+                records = [("device", dev, self.eo.current_artwork_id(dev)) for dev in devs]
+                self.write_checkpoint(offset, self.write_records(f, records, header=True))
+
+            for page_offset, page in self.eo.favorites_pages(offset):
+                if page is None:
+                    # Keep the checkpoint so the next run resumes here.
+                    self.logger.error("export to {0} interrupted at offset {1}.".format(
+                        self.path, page_offset))
+                    return None
+                records = [("favorite", fav, fav.get("artwork", {}).get("id", "")) for fav in page]
+                size = self.write_records(f, records)
+                count += len(page)
+                self.write_checkpoint(page_offset + len(page), size)
+
+        os.remove(self.checkpoint_path)
+        self.logger.info("exported {0} favorites to {1}".format(count, self.path))
+        return count
@@ -0,0 +1,163 @@
+import collections
+import json
+import logging
+import os
+import random
+
+
+class Rotation(object):
+    """The Rotation picks favorites to display so that none repeats within a window of picks.
+
+    It combines two structures:
+        * A shuffle bag: a shuffled list of the artwork ids not yet shown in this pass through the
+          favorites. Each pick pops the end of the list. When the bag is empty, it's refilled with
+          a new shuffle of every favorite that wasn't shown recently.
+        * A ring of the last `window` picks, with a dict indexing each id to its latest pick
+          number. An id shown within the last `window` picks isn't picked again, even across
+          refills.
+
+    A pick takes O(1) time, plus an O(n) refill once per pass through n favorites. Favorites that
+    are added are inserted at random places in the bag. Favorites that are removed are skipped
+    when they come up. Only artwork ids are kept, not the favorites' JSON.
+
+    The window is kept as configured, except that it's reduced to one less than the number of
+    favorites when there are too few for it, so that a pick is always possible. A warning is logged
+    when that happens. The closer the window is to the number of favorites, the fewer favorites
+    each refill has to shuffle. At one less, the picks settle into a fixed order.
+
+    The state is saved to a JSON file so that the rotation continues across runs, such as when
+    eo.py is run periodically by cron.
+    """
+
+    def __init__(self, window, path=None):
+        """Initialize an empty rotation.
+
+        Args:
+            window: the number of picks within which a favorite won't be repeated. If there
+                aren't more favorites than that, one less than the number of favorites is used.
+            path: the file to save the rotation to, if any.
+        """
+        self.logger = logging.getLogger(".".join(["eo", self.__class__.__name__]))
+        self.path = path
+        self.window = max(window, 0)
+        self.members = set()  # The ids of the current favorites.
+        self.bag = []
+        self.recent = collections.deque()  # (id, pick number) of the last self.window picks
+        self.last_shown = {}  # id -> pick number, for each id in self.recent
+        self.picks = 0
+        self.warned_window = None  # The last reduced window a warning was logged for.
+
+    @classmethod
+    def load(cls, path, window):
+        """Return the rotation saved in the given file, or a new one if it can't be read.
+
+        Args:
+            path: the file the rotation is saved to.
+            window: the number of picks within which a favorite won't be repeated. This may
+                differ from the saved rotation's window.
+        """
+        rotation = cls(window, path)
+        try:
+            with open(path, "r") as f:
+                state = json.load(f)
+            rotation.members = set(state["members"])
+            rotation.bag = list(state["bag"])
+            for artwork_id in state["recent"]:
+                rotation.remember(artwork_id)
+        except (IOError, OSError):
+            pass  # No saved rotation yet.
+        except Exception as e:
+            rotation.logger.error("ignoring unreadable rotation file {0}: {1}".format(path, e))
+            rotation = cls(window, path)
+        return rotation
+
+    def save(self):
+        """Save the rotation to self.path.
+
+        The file is written to a temporary file and renamed so that an interruption can't leave a
+        partially written file behind.
+        """
+        state = {
+            "members": list(self.members),
+            "bag": self.bag,
+            "recent": [artwork_id for (artwork_id, _) in self.recent]
+        }
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.rename(tmp_path, self.path)
+
+    def sync(self, artwork_ids):
+        """Update the rotation to the given artwork ids of the current favorites.
+
+        New ids are each inserted at a random place in the bag. Removed ids stay in the bag and
+        the recent ring until they're skipped or pushed out.
+        """
+        current = set(artwork_ids)
+        for artwork_id in current - self.members:
+            self.bag.append(artwork_id)
+            i = random.randint(0, len(self.bag) - 1)
+            self.bag[i], self.bag[-1] = self.bag[-1], self.bag[i]
+        self.members = current
+
+    def remember(self, artwork_id):
+        """Record the artwork id as shown, pushing the oldest pick out of the recent ring if full."""
+        self.picks += 1
+        self.recent.append((artwork_id, self.picks))
+        self.last_shown[artwork_id] = self.picks
+        while len(self.recent) > self.window:
+            (old_id, old_pick) = self.recent.popleft()
+            if self.last_shown.get(old_id) == old_pick:  # Not shown again since.
+                del self.last_shown[old_id]
+
+    def effective_window(self):
+        """Return the window in use: self.window, but at most one less than the number of
+        favorites.
+        """
+        return min(self.window, max(len(self.members) - 1, 0))
+
+    def is_recent(self, artwork_id):
+        """Return True if the artwork id was shown within the effective window."""
+        last_pick = self.last_shown.get(artwork_id)
+        return last_pick is not None and self.picks - last_pick < self.effective_window()
+
+    def refill(self):
+        """Refill the bag with a new shuffle of the favorites not shown recently."""
+        window = self.effective_window()
+        if self.members and window < self.window and window != self.warned_window:
+            self.logger.warning("only {0} favorites for a rotation window of {1}. Using a window "
+                                "of {2}.".format(len(self.members), self.window, window))
+            self.warned_window = window
+        self.bag = [artwork_id for artwork_id in self.members if not self.is_recent(artwork_id)]
+        random.shuffle(self.bag)
+
+    def next(self, artwork_ids=None, current_id=None):
+        """Pick the next artwork id to display and record it as shown.
+
+        Args:
+            artwork_ids: if given, the artwork ids of the current favorites. See sync().
+            current_id: the id of the artwork on display now, if known. Unless it was the last
+                pick, it's recorded as shown, since it may have been chosen elsewhere, such as in
+                the Electric Objects app.
+
+        Returns:
+            An artwork id, or None if there are no favorites.
+        """
+        if artwork_ids is not None:
+            self.sync(artwork_ids)
+        if current_id in self.members and self.last_shown.get(current_id) != self.picks:
+            self.remember(current_id)
+
+        refilled = False
+        while True:
+            if not self.bag:
+                if refilled:
+                    return None  # No favorites.
+                self.refill()
+                refilled = True
+                continue
+            artwork_id = self.bag.pop()
+            # Skip removed favorites and ones shown since the bag was filled.
+            if artwork_id in self.members and not self.is_recent(artwork_id):
+                self.remember(artwork_id)
+                return artwork_id
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    A thundering-herd simulator for the schedule jitter and retry settings.
+
+    Simulates many clients, each making one scheduled request to a server with limited capacity,
+    possibly through one or more outages. The clients use the real Scheduler.next_event() and
+    Scheduler.add_jitter() to pick their request times, and the real EO_Net retry policy,
+    EO_Net.should_retry() and EO_Net.retry_delays(), to retry failures. Time is virtual, so
+    simulating hours of traffic from thousands of clients takes seconds.
+
+    The report shows the peak request rate the server sees, how long requests wait in its queue,
+    and how long after each outage ends the first request is served. Use it to compare settings before
+    deploying them. For example, compare:
+
+        $ python simulator.py --clients 5000 --schedule-jitter 0 --outage 0:120
+        $ python simulator.py --clients 5000 --schedule-jitter 10 --outage 0:120
+
+    Written for Python 2.7.x.
+"""
+
+import argparse
+import collections
+import datetime
+import eo
+import eo_net
+import heapq
+import random
+from scheduler import Scheduler
+
+# The modeled server. It serves requests in arrival order at SERVER_CAPACITY requests per second.
+# Requests that would wait longer than MAX_QUEUE_DELAY are rejected with a 503, as are all
+# requests during an outage.
+SERVER_CAPACITY = 50.0  # requests per second, float
+MAX_QUEUE_DELAY = 10.0  # seconds, float
+
+SimulatedResponse = collections.namedtuple("SimulatedResponse", ["status_code", "reason"])
+
+OK_RESPONSE = SimulatedResponse(200, "OK")
+UNAVAILABLE_RESPONSE = SimulatedResponse(503, "Service Unavailable")
+
+
+class SimulatedServer(object):
+    """A server with a fixed capacity, a bounded queue, and scheduled outages.
+
+    Times are virtual seconds, and requests must arrive in time order.
+    """
+
+    def __init__(self, capacity, max_queue_delay, outages=()):
+        """Initialize the server.
+
+        Args:
+            capacity: the number of requests served per second.
+            max_queue_delay: the longest a request may wait in the queue before it's rejected.
+            outages: a list of (start, end) times during which all requests are rejected.
+        """
+        self.service_time = 1.0 / capacity
+        self.max_queue_delay = max_queue_delay
+        self.outages = sorted(outages)
+        self.busy_until = None
+
+        self.arrivals = collections.Counter()  # whole second -> requests arriving in it
+        self.rejections = []
+        self.queue_delays = []
+        self.successes = []  # (arrival time, response time) of each served request
+
+    def in_outage(self, t):
+        return any(start <= t < end for (start, end) in self.outages)
+
+    def request(self, t):
+        """Handle a request arriving at time t.
+
+        Returns:
+            A (response, time) tuple, where time is when the client receives the response.
+        """
+        self.arrivals[int(t // 1)] += 1
+        if self.in_outage(t):
+            self.rejections.append(t)
+            return (UNAVAILABLE_RESPONSE, t)
+
+        start = t if self.busy_until is None else max(t, self.busy_until)
+        if start - t > self.max_queue_delay:
+            self.rejections.append(t)
+            return (UNAVAILABLE_RESPONSE, t)
+
+        self.queue_delays.append(start - t)
+        self.busy_until = start + self.service_time
+        self.successes.append((t, self.busy_until))
+        return (OK_RESPONSE, self.busy_until)
+
+
+class Simulation(object):
+    """Runs a set of simulated clients against a SimulatedServer and reports the results."""
+
+    def __init__(self, num_clients, server, schedule=eo.SCHEDULE,
+                 schedule_jitter=eo.SCHEDULE_JITTER, initial_retry_delay=eo_net.INITIAL_RETRY_DELAY,
+                 num_retries=eo_net.NUM_RETRIES, jitter_factor=eo_net.JITTER_FACTOR):
+        """Initialize the simulation.
+
+        Args:
+            num_clients: the number of clients.
+            server: the SimulatedServer.
+            schedule: the clients' schedule, as for Scheduler.
+            schedule_jitter: the +/- number of minutes to randomize the scheduled times.
+            initial_retry_delay, num_retries, jitter_factor: the clients' retry policy. See
+                EO_Net.request_with_retries().
+        """
+        self.num_clients = num_clients
+        self.server = server
+        self.scheduler = Scheduler(schedule, None, schedule_jitter=schedule_jitter)
+        self.net = eo_net.EO_Net()
+        self.net.initial_retry_delay = initial_retry_delay
+        self.net.num_retries = num_retries
+        self.net.jitter_factor = jitter_factor
+
+        self.completion_times = []
+        self.attempts = collections.Counter()  # attempts -> number of clients that succeeded
+        self.gave_up = 0
+
+    def run(self):
+        """Simulate every client's next scheduled request, including retries.
+
+        Times are in seconds relative to the next unjittered scheduled time, so outages should be
+        given relative to it too.
+        """
+        now = datetime.datetime.now()
+        scheduled = self.scheduler.next_event(now)
+
+        # Each event is a client's next request: (time, client, attempt, retry delay generator).
+        events = []
+        for client in range(self.num_clients):
+            t = (self.scheduler.add_jitter(scheduled) - scheduled).total_seconds()
+            events.append((t, client, 1, self.net.retry_delays()))
+        heapq.heapify(events)
+
+        while events:
+            (t, client, attempt, delays) = heapq.heappop(events)
+            (response, response_time) = self.server.request(t)
+            if not self.net.should_retry(response):
+                self.completion_times.append(response_time)
+                self.attempts[attempt] += 1
+                continue
+            delay = next(delays, None)
+            if delay is None:
+                self.gave_up += 1
+                continue
+            heapq.heappush(events, (response_time + delay, client, attempt + 1, delays))
+
+    def recovery_times(self):
+        """Return, for each outage, the seconds from its end until the first request sent after
+        it ended was served, or None if none was served before the next outage started.
+        """
+        recoveries = []
+        outages = self.server.outages
+        for i, (start, end) in enumerate(outages):
+            next_start = outages[i + 1][0] if i + 1 < len(outages) else float("inf")
+            served = [done for (t, done) in self.server.successes if end <= t < next_start]
+            recoveries.append(min(served) - end if served else None)
+        return recoveries
+
+    def report(self):
+        """Return the results as a list of lines of text."""
+        arrivals = self.server.arrivals
+        delays = sorted(self.server.queue_delays)
+        completions = sorted(self.completion_times)
+        succeeded = len(completions)
+        lines = [
+            "clients: {0}, succeeded: {1}, gave up: {2}".format(
+                self.num_clients, succeeded, self.gave_up),
+            "requests: {0}, rejected: {1}".format(
+                sum(arrivals.values()), len(self.server.rejections)),
+            "peak requests per second: {0} (server capacity {1:.0f})".format(
+                max(arrivals.values()) if arrivals else 0, 1.0 / self.server.service_time),
+        ]
+        if delays:
+            lines.append("queue delay: mean {0:.2f}s, p99 {1:.2f}s, max {2:.2f}s".format(
+                sum(delays) / len(delays), percentile(delays, 0.99), delays[-1]))
+        for (start, end), recovery in zip(self.server.outages, self.recovery_times()):
+            if recovery is None:
+                lines.append("outage {0:.0f}s to {1:.0f}s: never recovered, no request after it "
+                             "ended succeeded".format(start, end))
+            else:
+                lines.append("outage {0:.0f}s to {1:.0f}s: first success {2:.1f}s after it "
+                             "ended".format(start, end, recovery))
+        if completions:
+            lines.append("completed: p50 at {0:.1f}s, p99 at {1:.1f}s, last at {2:.1f}s".format(
+                percentile(completions, 0.50), percentile(completions, 0.99), completions[-1]))
+        lines.append("attempts per successful client: " + ", ".join(
+            "{0}: {1}".format(n, self.attempts[n]) for n in sorted(self.attempts)))
+        return lines
+
+
+def percentile(sorted_values, fraction):
+    """Return the given fraction's percentile of a non-empty sorted list."""
+    index = min(int(fraction * len(sorted_values)), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def parse_outage(text):
+    """Parse an outage of the form "START:END", in seconds, into a (start, end) tuple."""
+    try:
+        (start, end) = map(float, text.split(":"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("outage must be START:END in seconds: " + text)
+    if end <= start:
+        raise argparse.ArgumentTypeError("outage must end after it starts: " + text)
+    return (start, end)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate a thundering herd of eo-python clients.")
+    parser.add_argument("--clients", type=int, default=5000, help="number of clients")
+    parser.add_argument("--capacity", type=float, default=SERVER_CAPACITY,
+                        help="server capacity in requests per second")
+    parser.add_argument("--max-queue-delay", type=float, default=MAX_QUEUE_DELAY,
+                        help="seconds a request may wait before the server rejects it")
+    parser.add_argument("--outage", type=parse_outage, action="append", default=[],
+                        help="START:END in seconds relative to the scheduled time. Repeatable. "
+                             "Write negative starts as --outage=-60:60.")
+    parser.add_argument("--schedule-jitter", type=float, default=eo.SCHEDULE_JITTER,
+                        help="+/- minutes to randomize the scheduled time")
+    parser.add_argument("--retry-delay", type=float, default=eo_net.INITIAL_RETRY_DELAY,
+                        help="seconds before the first retry")
+    parser.add_argument("--retries", type=int, default=eo_net.NUM_RETRIES,
+                        help="number of retries")
+    parser.add_argument("--jitter-factor", type=float, default=eo_net.JITTER_FACTOR,
+                        help="retry delay jitter as a fraction of the delay")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="random seed, so runs with different settings see the same draws")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+
+    server = SimulatedServer(args.capacity, args.max_queue_delay, args.outage)
+    simulation = Simulation(args.clients, server, schedule_jitter=args.schedule_jitter,
+                            initial_retry_delay=args.retry_delay, num_retries=args.retries,
+                            jitter_factor=args.jitter_factor)
+    simulation.run()
+    for line in simulation.report():
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+import collections
+import eo_net
+import heapq
+import logging
+import time
+
+# BEST PRACTICE, "adaptive polling": poll quickly while things are changing and back off
+# exponentially while they aren't. After a change is seen, the poll interval for that account
+# drops to MIN_POLL_INTERVAL. Each poll that finds no change multiplies it by POLL_BACKOFF, up to
+# MAX_POLL_INTERVAL.
+MIN_POLL_INTERVAL = 15.0  # seconds, float
+MAX_POLL_INTERVAL = 600.0  # seconds, float
+POLL_BACKOFF = 2.0
+
+# BEST PRACTICE, "rate limiting": the most HTTP requests to make across all watched accounts in
+# each BUDGET_PERIOD, counting sign-ins and retries as well as polls. When there are more accounts
+# than the budget allows at their desired intervals, polls are delayed, with the most overdue
+# account polled first.
+REQUEST_BUDGET = 30  # requests per BUDGET_PERIOD
+BUDGET_PERIOD = 60.0  # seconds, float
+
+# Kinds of device changes.
+DEVICE_ADDED = "added"
+DEVICE_REMOVED = "removed"
+ARTWORK_CHANGED = "artwork"
+STATE_CHANGED = "state"
+
+# A change in the state of a device.
+#   eo: the ElectricObject of the account the device belongs to.
+#   device_id: the id of the device.
+#   kind: one of DEVICE_ADDED, DEVICE_REMOVED, ARTWORK_CHANGED, or STATE_CHANGED. STATE_CHANGED
+#       means something other than the displayed artwork changed.
+#   old_artwork_id, new_artwork_id: the artwork ids displayed before and after the change, or 0.
+#   device: the device JSON after the change, or before it for DEVICE_REMOVED.
+DeviceChange = collections.namedtuple(
+    "DeviceChange", ["eo", "device_id", "kind", "old_artwork_id", "new_artwork_id", "device"])
+
+
+class WatchedAccount(object):
+    """The polling state of one account watched by a DeviceWatcher."""
+
+    def __init__(self, eo):
+        self.eo = eo
+        self.etag = None
+        self.devices = None  # device id -> device JSON, or None before the first poll.
+        self.interval = MIN_POLL_INTERVAL
+        self.next_poll = 0
+
+
+class DeviceWatcher(object):
+    """The DeviceWatcher polls the devices of one or more accounts and reports changes, such as a
+    new artwork being displayed, including changes made from the Electric Objects app or website.
+
+    Each account is polled adaptively: every MIN_POLL_INTERVAL seconds after a change, then backing
+    off exponentially to MAX_POLL_INTERVAL while nothing changes. Polls use conditional requests,
+    so servers that support ETags can reply without resending unchanged device lists. All of the
+    accounts share a global budget of REQUEST_BUDGET requests every BUDGET_PERIOD seconds. The
+    budget is an eo_net.RequestBudget set on each account's EO_Net, so it counts every request the
+    polls make, including sign-ins and retries.
+
+    Changes are reported as DeviceChange tuples, either to callbacks with run() or by iterating
+    over events().
+
+    Usage:
+        watcher = DeviceWatcher([eo1, eo2])
+        watcher.add_callback(lambda change: logger.info(str(change)))
+        watcher.run()
+    """
+
+    def __init__(self, eos, timefunc=time.time, delayfunc=time.sleep):
+        """Initialize the watcher.
+
+        Args:
+            eos: a list of ElectricObjects, one for each account to watch.
+            timefunc: a function returning the current time in seconds.
+            delayfunc: a function that waits the given number of seconds.
+        """
+        self.logger = logging.getLogger(".".join(["eo", self.__class__.__name__]))
+        self.timefunc = timefunc
+        self.delayfunc = delayfunc
+        self.callbacks = []
+        self.running = False
+        self.budget = eo_net.RequestBudget(REQUEST_BUDGET, BUDGET_PERIOD, timefunc, delayfunc)
+
+        # A heap of (next poll time, sequence number, account). The sequence number breaks ties.
+        self.queue = []
+        for i, eo in enumerate(eos):
+            eo.api.net.request_budget = self.budget
+            heapq.heappush(self.queue, (0, i, WatchedAccount(eo)))
+        self.sequence = len(eos)
+
+    def add_callback(self, fn):
+        """Call fn(change) with each DeviceChange found by run()."""
+        self.callbacks.append(fn)
+
+    def stop(self):
+        """Stop run() or events() after the current poll."""
+        self.running = False
+
+    def diff(self, eo, old_devices, new_devices):
+        """Return a list of DeviceChanges between two dicts of device id -> device JSON."""
+        changes = []
+        for device_id, device in new_devices.items():
+            new_artwork_id = eo.current_artwork_id(device)
+            if device_id not in old_devices:
+                changes.append(DeviceChange(eo, device_id, DEVICE_ADDED, 0, new_artwork_id, device))
+                continue
+            old_device = old_devices[device_id]
+            if device == old_device:
+                continue
+            old_artwork_id = eo.current_artwork_id(old_device)
+            kind = ARTWORK_CHANGED if old_artwork_id != new_artwork_id else STATE_CHANGED
+            changes.append(DeviceChange(eo, device_id, kind, old_artwork_id, new_artwork_id,
+                                        device))
+        for device_id, device in old_devices.items():
+            if device_id not in new_devices:
+                old_artwork_id = eo.current_artwork_id(device)
+                changes.append(DeviceChange(eo, device_id, DEVICE_REMOVED, old_artwork_id, 0,
+                                            device))
+        return changes
+
+    def poll(self, account):
+        """Poll the account's devices, update its state, and return a list of DeviceChanges.
+
+        The first poll of an account records its devices without reporting them as changes.
+        """
+        result = account.eo.devices_if_modified(account.etag)
+        if result is None:
+            self.logger.error("in poll: no devices returned.")
+            return []
+        (modified, devs, etag) = result
+        account.etag = etag
+        if not modified:
+            return []
+
+        devices = dict((dev.get("id"), dev) for dev in devs or [])
+        if account.devices is None:
+            account.devices = devices
+            return []
+        changes = self.diff(account.eo, account.devices, devices)
+        account.devices = devices
+        return changes
+
+    def schedule(self, account, changed):
+        """Set the account's next poll time, speeding up after a change and backing off
+        otherwise.
+        """
+        if changed:
+            account.interval = MIN_POLL_INTERVAL
+        else:
+            account.interval = min(account.interval * POLL_BACKOFF, MAX_POLL_INTERVAL)
+        # Jitter: don't let accounts started together stay in lockstep.
+        delay = account.eo.api.net.jitter(account.interval, eo_net.JITTER_FACTOR)
+        account.next_poll = self.timefunc() + delay
+        heapq.heappush(self.queue, (account.next_poll, self.sequence, account))
+        self.sequence += 1
+
+    def wait_for_turn(self, next_poll):
+        """Wait until the given poll time. The poll's requests then wait for the request budget."""
+        delay = next_poll - self.timefunc()
+        if delay > 0:
+            self.delayfunc(delay)
+
+    def events(self):
+        """Poll the accounts until stop() is called, generating each DeviceChange as it is found."""
+        self.running = True
+        while self.running and self.queue:
+            (next_poll, _, account) = heapq.heappop(self.queue)
+            self.wait_for_turn(next_poll)
+            changes = self.poll(account)
+            self.schedule(account, bool(changes))
+            for change in changes:
+                yield change
+
+    def run(self):
+        """Poll the accounts until stop() is called, passing each DeviceChange to the callbacks."""
+        for change in self.events():
+            for fn in self.callbacks:
+                try:
+                    fn(change)
+                except Exception as e:
+                    self.logger.error("problem in device change callback: {0}".format(e))